@@ -12,8 +12,82 @@
 # License for the specific language governing permissions and limitations
 # under the License.
 
+import contextlib
+import threading
+
 import six
 
+# The number of independently locked shards that per-project enforcement
+# state is spread across. Requests for projects that land in different shards
+# never wait on each other.
+_DEFAULT_SHARD_COUNT = 32
+
+# The limit value Keystone unified limits use for an unlimited resource.
+_UNLIMITED = -1
+
+
+class _ProjectStateShards(object):
+
+    def __init__(self, shard_count=_DEFAULT_SHARD_COUNT):
+        """Per-project state striped across independently locked shards.
+
+        A project always maps to the same shard, so every read or write for a
+        project is serialized against that project's shard lock only. The
+        locks come from ``threading``, which eventlet monkey patches into
+        green locks, so the same structure works for native and green
+        threads.
+
+        :param shard_count: The number of shards to stripe state across.
+        :type shard_count: integer
+
+        """
+
+        if (isinstance(shard_count, bool) or
+                not isinstance(shard_count, int) or shard_count < 1):
+            msg = 'shard_count must be a positive integer.'
+            raise ValueError(msg)
+
+        self._shards = [
+            ({}, threading.Lock()) for _ in six.moves.range(shard_count)
+        ]
+
+    def _shard_for(self, project_id):
+        return self._shards[hash(project_id) % len(self._shards)]
+
+    @contextlib.contextmanager
+    def locked(self, project_id):
+        """Hold the shard lock and yield the state dict for a project."""
+        projects, lock = self._shard_for(project_id)
+        with lock:
+            yield projects.setdefault(project_id, {})
+
+    @contextlib.contextmanager
+    def peek(self, project_id):
+        """Hold the shard lock and yield a project's state for reading.
+
+        Unlike ``locked``, nothing is added for an unknown project, so the
+        yielded dict must not be modified.
+        """
+        projects, lock = self._shard_for(project_id)
+        with lock:
+            yield projects.get(project_id, {})
+
+    def clear(self, project_id=None):
+        if project_id is not None:
+            projects, lock = self._shard_for(project_id)
+            with lock:
+                projects.pop(project_id, None)
+            return
+
+        for projects, lock in self._shards:
+            with lock:
+                projects.clear()
+
+
+# Cached limits and usage shared by the whole process, keyed by project_id.
+# Read by get_headroom and filled by cache_limit and cache_usage.
+_PROJECT_STATE = _ProjectStateShards()
+
 
 class ProjectClaim(object):
 
@@ -83,3 +157,142 @@ class Enforcer(object):
 
     def __exit__(self, *args):
         pass
+
+
+def _validate_cached_value(project_id, resource_name, value, value_name,
+                           minimum):
+    if not isinstance(project_id, six.string_types):
+        msg = 'project_id must be a string type.'
+        raise ValueError(msg)
+
+    if not isinstance(resource_name, six.string_types):
+        msg = 'resource_name must be a string type.'
+        raise ValueError(msg)
+
+    if (isinstance(value, bool) or
+            not isinstance(value, int) or value < minimum):
+        msg = '%s must be an integer of at least %d.' % (value_name, minimum)
+        raise ValueError(msg)
+
+
+def cache_limit(project_id, resource_name, limit):
+    """Cache the limit of a resource for a project.
+
+    :param project_id: The ID of the project the limit applies to.
+    :type project_id: string
+    :param resource_name: A string representing the limited resource.
+    :type resource_name: string
+    :param limit: The total number of resources the project may have, or -1
+                  if the resource is unlimited.
+    :type limit: integer
+
+    """
+
+    _validate_cached_value(
+        project_id, resource_name, limit, 'limit', _UNLIMITED
+    )
+    with _PROJECT_STATE.locked(project_id) as state:
+        state.setdefault('limits', {})[resource_name] = limit
+
+
+def cache_usage(project_id, resource_name, usage):
+    """Cache the current usage of a resource for a project.
+
+    :param project_id: The ID of the project consuming the resource.
+    :type project_id: string
+    :param resource_name: A string representing the consumed resource.
+    :type resource_name: string
+    :param usage: The number of resources the project currently has.
+    :type usage: integer
+
+    """
+
+    _validate_cached_value(project_id, resource_name, usage, 'usage', 0)
+    with _PROJECT_STATE.locked(project_id) as state:
+        state.setdefault('usage', {})[resource_name] = usage
+
+
+def clear_cache(project_id=None):
+    """Drop cached limits and usage for one project, or for all projects.
+
+    :param project_id: The ID of the project to clear. When omitted, the
+                       cache is cleared for every project.
+    :type project_id: string
+
+    """
+
+    _PROJECT_STATE.clear(project_id)
+
+
+def get_headroom(claims, usage_callback=None):
+    """Calculate the remaining quota for claims without enforcing them.
+
+    This is a read-only check against cached limits and usage. Nothing is
+    claimed, verified or cached, so it is safe to call from UI or scheduling
+    code. When both the limit and the usage are cached, no round-trips are
+    made.
+
+    :param claims: The project and resource pairs to check. A claim with a
+                   quantity reports the headroom left after that quantity is
+                   consumed, which is negative if the claim would exceed the
+                   limit. Each pair may only be claimed once.
+    :type claims: iterable of ``oslo_limit.limit.ProjectClaim``
+    :param usage_callback: A callable function that accepts a project_id
+                           string and a resource_name string as parameters and
+                           calculates the current usage of that resource. It
+                           is only called when usage for a claim is not
+                           cached, and its result is not cached. Unlike the
+                           ``Enforcer`` callback, it is passed the resource
+                           name because claims may cover several resources.
+    :type callable function:
+    :returns: a dict mapping ``(project_id, resource_name)`` tuples to the
+              remaining quantity, to ``float('inf')`` when the resource is
+              unlimited, or to ``None`` when the limit or the usage is
+              unknown.
+
+    """
+
+    claims = list(claims)
+    seen = set()
+    for claim in claims:
+        if not isinstance(claim, ProjectClaim):
+            msg = ('claims must be instances of '
+                   'oslo_limit.limit.ProjectClaim.')
+            raise ValueError(msg)
+        key = (claim.project_id, claim.resource_name)
+        if key in seen:
+            msg = ('claims must not contain the same project_id and '
+                   'resource_name more than once.')
+            raise ValueError(msg)
+        seen.add(key)
+    if usage_callback and not callable(usage_callback):
+        msg = 'usage_callback must be a callable function.'
+        raise ValueError(msg)
+
+    headroom = {}
+    for claim in claims:
+        key = (claim.project_id, claim.resource_name)
+        with _PROJECT_STATE.peek(claim.project_id) as state:
+            limit = state.get('limits', {}).get(claim.resource_name)
+            usage = state.get('usage', {}).get(claim.resource_name)
+
+        if limit is None:
+            headroom[key] = None
+            continue
+
+        if limit == _UNLIMITED:
+            headroom[key] = float('inf')
+            continue
+
+        if usage is None:
+            if not usage_callback:
+                headroom[key] = None
+                continue
+            usage = usage_callback(claim.project_id, claim.resource_name)
+            _validate_cached_value(
+                claim.project_id, claim.resource_name, usage, 'usage', 0
+            )
+
+        headroom[key] = limit - usage - (claim.quantity or 0)
+
+    return headroom
@@ -19,6 +19,7 @@ test_limit
 Tests for `limit` module.
 """
 
+import threading
 import uuid
 
 from oslotest import base
@@ -154,3 +155,375 @@ class TestEnforcer(base.BaseTestCase):
                 limit.Enforcer,
                 invalid_claim,
             )
+
+
+class TestProjectStateShards(base.BaseTestCase):
+
+    def setUp(self):
+        super(TestProjectStateShards, self).setUp()
+        self.state = limit._ProjectStateShards(shard_count=4)
+        self.project_id = uuid.uuid4().hex
+
+    def _get_usage(self, project_id):
+        with self.state.peek(project_id) as state:
+            return state.get('usage')
+
+    def _set_usage(self, project_id, usage):
+        with self.state.locked(project_id) as state:
+            state['usage'] = usage
+
+    def test_locked_stores_state(self):
+        self._set_usage(self.project_id, 5)
+
+        self.assertEqual(5, self._get_usage(self.project_id))
+        self.assertIsNone(self._get_usage(uuid.uuid4().hex))
+
+    def test_peek_does_not_add_unknown_project(self):
+        with self.state.peek(self.project_id) as state:
+            self.assertEqual({}, state)
+
+        for projects, _ in self.state._shards:
+            self.assertEqual({}, projects)
+
+    def test_clear_single_project(self):
+        other_project_id = uuid.uuid4().hex
+        self._set_usage(self.project_id, 5)
+        self._set_usage(other_project_id, 7)
+
+        self.state.clear(self.project_id)
+
+        self.assertIsNone(self._get_usage(self.project_id))
+        self.assertEqual(7, self._get_usage(other_project_id))
+
+    def test_clear_all_projects(self):
+        project_ids = [uuid.uuid4().hex for _ in range(10)]
+        for project_id in project_ids:
+            self._set_usage(project_id, 1)
+
+        self.state.clear()
+
+        for project_id in project_ids:
+            self.assertIsNone(self._get_usage(project_id))
+
+    def test_shard_count_must_be_a_positive_integer(self):
+        invalid_shard_counts = [
+            0, -1, 1.5, uuid.uuid4().hex, None, True, False
+        ]
+
+        for invalid_shard_count in invalid_shard_counts:
+            self.assertRaises(
+                ValueError,
+                limit._ProjectStateShards,
+                shard_count=invalid_shard_count
+            )
+
+    def _project_id_in_shard(self, shard):
+        while True:
+            project_id = uuid.uuid4().hex
+            if self.state._shard_for(project_id) is shard:
+                return project_id
+
+    def _enter_in_thread(self, project_id):
+        entered = threading.Event()
+
+        def enter():
+            with self.state.locked(project_id):
+                entered.set()
+
+        thread = threading.Thread(target=enter)
+        thread.daemon = True
+        thread.start()
+        return entered
+
+    def test_only_projects_in_the_same_shard_block(self):
+        held = threading.Event()
+        release = threading.Event()
+        shard = self.state._shard_for(self.project_id)
+        other_shard = next(s for s in self.state._shards if s is not shard)
+        same_shard_project_id = self._project_id_in_shard(shard)
+        other_shard_project_id = self._project_id_in_shard(other_shard)
+
+        def hold():
+            with self.state.locked(self.project_id):
+                held.set()
+                release.wait()
+
+        holder = threading.Thread(target=hold)
+        holder.start()
+        self.addCleanup(holder.join)
+        self.addCleanup(release.set)
+        self.assertTrue(held.wait(5))
+
+        other_shard_entered = self._enter_in_thread(other_shard_project_id)
+        self.assertTrue(other_shard_entered.wait(5))
+
+        same_shard_entered = self._enter_in_thread(same_shard_project_id)
+        self.assertFalse(same_shard_entered.wait(0.1))
+
+        release.set()
+        self.assertTrue(same_shard_entered.wait(5))
+
+    def test_concurrent_updates_are_not_lost(self):
+        project_ids = [uuid.uuid4().hex for _ in range(8)]
+        iterations = 500
+
+        def increment():
+            for _ in range(iterations):
+                for project_id in project_ids:
+                    with self.state.locked(project_id) as state:
+                        state['usage'] = state.get('usage', 0) + 1
+
+        threads = [threading.Thread(target=increment) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        for project_id in project_ids:
+            self.assertEqual(
+                len(threads) * iterations,
+                self._get_usage(project_id)
+            )
+
+
+class TestHeadroom(base.BaseTestCase):
+
+    def setUp(self):
+        super(TestHeadroom, self).setUp()
+        limit.clear_cache()
+        self.addCleanup(limit.clear_cache)
+        self.resource_name = uuid.uuid4().hex
+        self.project_id = uuid.uuid4().hex
+        self.key = (self.project_id, self.resource_name)
+        self.claim = limit.ProjectClaim(self.resource_name, self.project_id)
+
+    def _get_usage(self, project_id, resource_name):
+        return 8
+
+    def test_headroom_from_cache(self):
+        limit.cache_limit(self.project_id, self.resource_name, 10)
+        limit.cache_usage(self.project_id, self.resource_name, 3)
+
+        headroom = limit.get_headroom([self.claim])
+
+        self.assertEqual({self.key: 7}, headroom)
+
+    def test_headroom_accounts_for_claim_quantity(self):
+        limit.cache_limit(self.project_id, self.resource_name, 10)
+        limit.cache_usage(self.project_id, self.resource_name, 3)
+        claims = [
+            limit.ProjectClaim(self.resource_name, self.project_id,
+                               quantity=5),
+        ]
+
+        self.assertEqual({self.key: 2}, limit.get_headroom(claims))
+
+        claims = [
+            limit.ProjectClaim(self.resource_name, self.project_id,
+                               quantity=9),
+        ]
+
+        self.assertEqual({self.key: -2}, limit.get_headroom(claims))
+
+    def test_headroom_for_multiple_projects_and_resources(self):
+        other_resource_name = uuid.uuid4().hex
+        other_project_id = uuid.uuid4().hex
+        limit.cache_limit(self.project_id, self.resource_name, 10)
+        limit.cache_usage(self.project_id, self.resource_name, 3)
+        limit.cache_limit(self.project_id, other_resource_name, 4)
+        limit.cache_usage(self.project_id, other_resource_name, 4)
+        limit.cache_limit(other_project_id, self.resource_name, 20)
+        limit.cache_usage(other_project_id, self.resource_name, 1)
+        claims = [
+            self.claim,
+            limit.ProjectClaim(other_resource_name, self.project_id),
+            limit.ProjectClaim(self.resource_name, other_project_id),
+        ]
+
+        headroom = limit.get_headroom(claims)
+
+        expected = {
+            self.key: 7,
+            (self.project_id, other_resource_name): 0,
+            (other_project_id, self.resource_name): 19,
+        }
+        self.assertEqual(expected, headroom)
+
+    def test_unknown_limit_returns_none(self):
+        limit.cache_usage(self.project_id, self.resource_name, 3)
+
+        headroom = limit.get_headroom(
+            [self.claim], usage_callback=self._get_usage
+        )
+
+        self.assertEqual({self.key: None}, headroom)
+
+    def test_unknown_usage_without_callback_returns_none(self):
+        limit.cache_limit(self.project_id, self.resource_name, 10)
+
+        self.assertEqual({self.key: None}, limit.get_headroom([self.claim]))
+
+    def test_callback_usage_is_not_cached(self):
+        limit.cache_limit(self.project_id, self.resource_name, 10)
+        calls = []
+
+        def callback(project_id, resource_name):
+            calls.append((project_id, resource_name))
+            return self._get_usage(project_id, resource_name)
+
+        for _ in range(3):
+            headroom = limit.get_headroom(
+                [self.claim], usage_callback=callback
+            )
+            self.assertEqual({self.key: 2}, headroom)
+
+        self.assertEqual([self.key] * 3, calls)
+        self.assertEqual({self.key: None}, limit.get_headroom([self.claim]))
+
+    def test_callback_is_not_called_for_cached_usage(self):
+        limit.cache_limit(self.project_id, self.resource_name, 10)
+        limit.cache_usage(self.project_id, self.resource_name, 3)
+
+        def callback(project_id, resource_name):
+            self.fail('usage_callback called for cached usage')
+
+        headroom = limit.get_headroom([self.claim], usage_callback=callback)
+
+        self.assertEqual({self.key: 7}, headroom)
+
+    def test_callback_usage_is_per_resource(self):
+        other_resource_name = uuid.uuid4().hex
+        usage = {self.resource_name: 8, other_resource_name: 1024}
+        limit.cache_limit(self.project_id, self.resource_name, 20)
+        limit.cache_limit(self.project_id, other_resource_name, 4096)
+        claims = [
+            self.claim,
+            limit.ProjectClaim(other_resource_name, self.project_id),
+        ]
+
+        def callback(project_id, resource_name):
+            return usage[resource_name]
+
+        expected = {
+            self.key: 12,
+            (self.project_id, other_resource_name): 3072,
+        }
+        self.assertEqual(
+            expected, limit.get_headroom(claims, usage_callback=callback)
+        )
+
+    def test_unlimited_resource_has_infinite_headroom(self):
+        limit.cache_limit(self.project_id, self.resource_name, -1)
+        limit.cache_usage(self.project_id, self.resource_name, 1000)
+        claims = [
+            limit.ProjectClaim(self.resource_name, self.project_id,
+                               quantity=5),
+        ]
+
+        self.assertEqual({self.key: float('inf')}, limit.get_headroom(claims))
+
+    def test_unlimited_resource_does_not_need_usage(self):
+        limit.cache_limit(self.project_id, self.resource_name, -1)
+
+        def callback(project_id, resource_name):
+            self.fail('usage_callback called for an unlimited resource')
+
+        headroom = limit.get_headroom([self.claim], usage_callback=callback)
+
+        self.assertEqual({self.key: float('inf')}, headroom)
+
+    def test_unknown_project_is_not_added_to_cache(self):
+        limit.get_headroom([self.claim], usage_callback=self._get_usage)
+
+        for projects, _ in limit._PROJECT_STATE._shards:
+            self.assertEqual({}, projects)
+
+    def test_duplicate_claims_are_rejected(self):
+        claims = [
+            limit.ProjectClaim(self.resource_name, self.project_id,
+                               quantity=1),
+            limit.ProjectClaim(self.resource_name, self.project_id,
+                               quantity=2),
+        ]
+
+        self.assertRaises(ValueError, limit.get_headroom, claims)
+
+    def test_clear_cache(self):
+        limit.cache_limit(self.project_id, self.resource_name, 10)
+        limit.cache_usage(self.project_id, self.resource_name, 3)
+
+        limit.clear_cache(self.project_id)
+
+        self.assertEqual({self.key: None}, limit.get_headroom([self.claim]))
+
+    def test_claims_must_be_instances_of_project_claim(self):
+        invalid_claim_types = [uuid.uuid4().hex, 5, 5.1, True, False, [], {}]
+
+        for invalid_claim in invalid_claim_types:
+            self.assertRaises(
+                ValueError,
+                limit.get_headroom,
+                [invalid_claim]
+            )
+
+    def test_usage_callback_must_be_callable(self):
+        invalid_callback_types = [uuid.uuid4().hex, 5, 5.1]
+
+        for invalid_callback in invalid_callback_types:
+            self.assertRaises(
+                ValueError,
+                limit.get_headroom,
+                [self.claim],
+                usage_callback=invalid_callback
+            )
+
+    def test_usage_callback_must_return_valid_usage(self):
+        limit.cache_limit(self.project_id, self.resource_name, 10)
+        invalid_usages = ['five', 5.5, None, True, -1]
+
+        for invalid_usage in invalid_usages:
+            self.assertRaises(
+                ValueError,
+                limit.get_headroom,
+                [self.claim],
+                usage_callback=lambda p, r: invalid_usage
+            )
+
+    def test_cached_values_must_be_integers(self):
+        invalid_value_types = ['five', 5.5, [5], {5: 5}, None, True]
+
+        for invalid_value in invalid_value_types:
+            self.assertRaises(
+                ValueError,
+                limit.cache_limit,
+                self.project_id,
+                self.resource_name,
+                invalid_value
+            )
+            self.assertRaises(
+                ValueError,
+                limit.cache_usage,
+                self.project_id,
+                self.resource_name,
+                invalid_value
+            )
+
+    def test_limit_must_not_be_below_unlimited(self):
+        for invalid_limit in [-2, -100]:
+            self.assertRaises(
+                ValueError,
+                limit.cache_limit,
+                self.project_id,
+                self.resource_name,
+                invalid_limit
+            )
+
+    def test_usage_must_not_be_negative(self):
+        for invalid_usage in [-1, -100]:
+            self.assertRaises(
+                ValueError,
+                limit.cache_usage,
+                self.project_id,
+                self.resource_name,
+                invalid_usage
+            )
@@ -0,0 +1,92 @@
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""Contention benchmark for the per-project state shards.
+
+Runs a number of threads that update state for many projects through
+``_ProjectStateShards.locked``, first with a single shard (one global lock)
+and then with the default shard count, and prints the throughput of each.
+``--hold`` keeps each lock held for a short time, standing in for work done
+while the state is locked. Pass ``--eventlet`` to monkey patch first and run
+green threads instead, as an eventlet API worker would.
+
+Usage::
+
+    python tools/bench_shards.py [--threads N] [--projects N]
+                                 [--iterations N] [--hold SECONDS]
+                                 [--eventlet]
+"""
+
+import argparse
+import sys
+import threading
+import time
+import uuid
+
+from oslo_limit import limit
+
+
+def _parse_args(argv):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--threads', type=int, default=64,
+                        help='Number of concurrent threads.')
+    parser.add_argument('--projects', type=int, default=1000,
+                        help='Number of distinct project IDs.')
+    parser.add_argument('--iterations', type=int, default=200,
+                        help='Updates made by each thread.')
+    parser.add_argument('--hold', type=float, default=0.0001,
+                        help='Seconds each lock is held for.')
+    parser.add_argument('--eventlet', action='store_true',
+                        help='Monkey patch with eventlet before running.')
+    return parser.parse_args(argv)
+
+
+def _run(shard_count, project_ids, args):
+    state = limit._ProjectStateShards(shard_count=shard_count)
+
+    def worker(offset):
+        for i in range(args.iterations):
+            project_id = project_ids[(offset + i) % len(project_ids)]
+            with state.locked(project_id) as project_state:
+                project_state['usage'] = project_state.get('usage', 0) + 1
+                if args.hold:
+                    time.sleep(args.hold)
+
+    threads = [
+        threading.Thread(target=worker, args=(offset * 7,))
+        for offset in range(args.threads)
+    ]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    updates = args.threads * args.iterations
+    print('shards=%-4d updates=%-8d elapsed=%.3fs throughput=%.0f/s' % (
+        shard_count, updates, elapsed, updates / elapsed))
+
+
+def main(argv=None):
+    args = _parse_args(sys.argv[1:] if argv is None else argv)
+    if args.eventlet:
+        import eventlet
+        eventlet.monkey_patch()
+
+    project_ids = [uuid.uuid4().hex for _ in range(args.projects)]
+    for shard_count in (1, limit._DEFAULT_SHARD_COUNT):
+        _run(shard_count, project_ids, args)
+
+
+if __name__ == '__main__':
+    main()